@@ -4,7 +4,6 @@ Script to install SSL certificates for Python on macOS.
 Run this script to add the macOS system certificates to Python's certificate store.
 """
 import os
-import ssl
 import subprocess
 import sys
 
@@ -14,13 +13,6 @@ def install_certificates():
         print("This script is only for macOS.")
         return
     
-    # Check if certificates are already installed
-    try:
-        ssl.create_default_context().check_hostname
-        print("Certificates seem to be working already.")
-    except:
-        pass
-    
     # Find the current Python executable
     python_path = sys.executable
     
@@ -1,13 +1,20 @@
-from fastapi import FastAPI, Request, Response
+from fastapi import FastAPI, Request, Response, BackgroundTasks
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
-import requests
+from contextlib import asynccontextmanager
 import httpx
 import json
+import orjson
 import os
-import datetime
 import re
-import hashlib
 import hmac
+import hashlib
+import ssl
+import sys
+import atexit
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener
 
 load_dotenv(override=True)
 
@@ -19,30 +26,122 @@ VOGENT_VOICE_ID = os.environ.get('VOGENT_VOICE_ID')
 VOGENT_WEBHOOK_SECRET = os.environ.get('VOGENT_WEBHOOK_SECRET', 'inDYZbs7BXHC59w')
 N8N_WEBHOOK_URL = os.environ.get('N8N_WEBHOOK_URL')
 PORT = int(os.environ.get('PORT', '8000'))
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+MAX_WEBHOOK_BODY = int(os.environ.get('MAX_WEBHOOK_BODY', str(1024 * 1024)))  # 1 MiB
+
+# Log through a queue so stdout writes happen on a background thread
+# instead of blocking the event loop inside request handlers
+logger = logging.getLogger("onit")
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+_log_queue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(_log_queue))
+_log_stream_handler = logging.StreamHandler(sys.stdout)
+_log_stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_stream_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# Encode the webhook secret once instead of on every request
+_WEBHOOK_SECRET_BYTES = VOGENT_WEBHOOK_SECRET.encode('utf-8')
+
+# Precompiled pattern for stripping non-digit characters from phone numbers
+_NON_DIGIT_RE = re.compile(r'\D')
+
+# Request headers are fixed for the process lifetime, so build them once
+_VOGENT_HEADERS = {
+    "Authorization": f"Bearer {VOGENT_API_KEY}",
+    "Content-Type": "application/json"
+}
+_N8N_HEADERS = {"Content-Type": "application/json"}
+
+# Pre-serialized bodies for fixed responses, so they skip JSON encoding
+_ROOT_RESPONSE = Response(content=b'{"message":"Vogent Integration Server is running!"}', media_type="application/json")
+_SUCCESS_BODY = b'{"success":true}'
+
+# Per-request timeouts for outbound calls
+VOGENT_TIMEOUT = httpx.Timeout(60.0, connect=15.0)  # 60s total, 15s connect for API calls
+N8N_TIMEOUT = httpx.Timeout(30.0, connect=10.0)  # 30s total, 10s connect
+
+def check_sha256_backend():
+    """
+    Warn if SHA-256 (used for webhook HMACs) is not backed by OpenSSL, which
+    uses SHA-NI / ARMv8 SHA instructions automatically on supporting CPUs
+    """
+    if getattr(hashlib.sha256, '__name__', '') != 'openssl_sha256':
+        logger.warning("⚠️ hashlib SHA-256 is not OpenSSL-backed; webhook HMACs will use the slower built-in implementation")
+    else:
+        logger.debug("SHA-256 backend: %s", ssl.OPENSSL_VERSION)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Share one pooled HTTP client across requests so connections (and TLS
+    sessions) to Vogent and N8N are reused instead of re-established per call
+    """
+    check_sha256_backend()
+    app.state.http = httpx.AsyncClient(
+        timeout=VOGENT_TIMEOUT,
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=100)
+    )
+    try:
+        yield
+    finally:
+        await app.state.http.aclose()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
-def verify_webhook_signature(payload_body: bytes, signature: str, secret: str) -> bool:
+def verify_webhook_signature(payload_body: bytes, signature: str, secret_bytes: bytes) -> bool:
     """
     Verify webhook signature from Vogent using HMAC-SHA256
     """
+    # Decode the hex signature header (optionally prefixed with "sha256=")
     try:
-        # Create HMAC with secret
-        expected_signature = hmac.new(
-            secret.encode('utf-8'),
-            payload_body,
-            hashlib.sha256
-        ).hexdigest()
+        signature_bytes = bytes.fromhex(signature.removeprefix('sha256='))
+    except ValueError:
+        logger.warning("❌ Malformed webhook signature")
+        return False
+
+    try:
+        # One-shot HMAC (C fast path, no intermediate HMAC object)
+        expected_signature = hmac.digest(secret_bytes, payload_body, 'sha256')
         
-        # Compare signatures using timing-safe comparison
-        return hmac.compare_digest(signature, expected_signature)
+        # Compare raw digests using timing-safe comparison
+        return hmac.compare_digest(signature_bytes, expected_signature)
     except Exception as e:
-        print(f"❌ Error verifying webhook signature: {e}")
+        logger.error("❌ Error verifying webhook signature: %s", e)
         return False
 
+async def read_body_sized(request: Request, max_size: int = MAX_WEBHOOK_BODY) -> bytes | None:
+    """
+    Read the request body into a buffer preallocated from Content-Length.
+    Returns None if the declared or actual body size exceeds max_size
+    """
+    # Never trust Content-Length beyond max_size: the client controls it and
+    # the buffer is allocated before the signature is checked
+    content_length = request.headers.get('content-length')
+    declared = int(content_length) if content_length and content_length.isdecimal() else 0
+    if declared > max_size:
+        return None
+    
+    buf = bytearray(declared)
+    offset = 0
+    async for chunk in request.stream():
+        end = offset + len(chunk)
+        if end > max_size:
+            return None
+        buf[offset:end] = chunk
+        offset = end
+    
+    # Guard against a body shorter than its declared length
+    if offset != len(buf):
+        del buf[offset:]
+    return bytes(buf)
+
 @app.get("/")
 async def root():
-    return {"message": "Vogent Integration Server is running!"}
+    return _ROOT_RESPONSE
 
 @app.post("/outgoing-call")
 async def outgoing_call(request: Request):
@@ -51,7 +150,7 @@ async def outgoing_call(request: Request):
     """
     try:
         # Get request data
-        data = await request.json()
+        data = orjson.loads(await request.body())
         phone_number = data.get('phoneNumber')
         lead_id = data.get('leadId')
         batch_id = data.get('batchId')
@@ -65,10 +164,10 @@ async def outgoing_call(request: Request):
         if not phone_number:
             return {"error": "Invalid phone number format"}
         
-        print('\n===== 📞 INITIATING OUTBOUND CALL =====')
-        print(f"   To: {phone_number}")
-        print(f"   Lead ID: {lead_id}")
-        print(f"   Batch ID: {batch_id}")
+        logger.info("===== 📞 INITIATING OUTBOUND CALL =====")
+        logger.info("   To: %s", phone_number)
+        logger.debug("   Lead ID: %s", lead_id)
+        logger.debug("   Batch ID: %s", batch_id)
         
         # Create outbound call via Vogent API
         call_data = await create_vogent_call(
@@ -80,58 +179,57 @@ async def outgoing_call(request: Request):
         
         # Check if call creation failed
         if not call_data or "id" not in call_data:
-            print("❌ Failed to create call with Vogent")
-            print("===== END CALL INITIATION =====\n")
+            logger.error("❌ Failed to create call with Vogent")
+            logger.info("===== END CALL INITIATION =====")
             return {
                 "lead_id": lead_id,
                 "batch_id": batch_id
             }
 
-        print(f"   Vogent call ID: {call_data['id']}")
-        print("===== END CALL INITIATION =====\n")
+        logger.info("   Vogent call ID: %s", call_data['id'])
+        logger.info("===== END CALL INITIATION =====")
         return {
             "success": True,
             "callId": call_data["id"]
         }
 
     except Exception as error:
-        print('\n❌ ERROR CREATING CALL:')
-        print(f"   Error: {str(error)}")
-        import traceback
-        traceback.print_exc()
-        print("===== END ERROR =====\n")
+        logger.exception("❌ ERROR CREATING CALL: %s", error)
         return {"error": str(error)}
 
 @app.post("/vogent-webhook")
-async def vogent_webhook(request: Request):
+async def vogent_webhook(request: Request, background_tasks: BackgroundTasks):
     """
     Handle webhooks from Vogent (call events, transcripts, extractor results)
     """
     try:
-        print(f"\n===== 📥 VOGENT WEBHOOK RECEIVED =====")
-        print(f"Timestamp: {datetime.datetime.now().isoformat()}")
+        logger.info("===== 📥 VOGENT WEBHOOK RECEIVED =====")
+        
+        # Check the signature header before reading the body, so unsigned requests are rejected cheaply
+        signature = request.headers.get('x-elto-signature', '')
+        if not signature:
+            logger.warning("❌ Missing X-Elto-Signature header")
+            return JSONResponse({"error": "Missing signature header"}, status_code=401)
         
         # Get the raw body for signature verification
-        raw_body = await request.body()
+        raw_body = await read_body_sized(request)
+        if raw_body is None:
+            logger.warning("❌ Webhook body exceeds %s bytes", MAX_WEBHOOK_BODY)
+            return JSONResponse({"error": "Payload too large"}, status_code=413)
         
         # Verify webhook signature
-        signature = request.headers.get('X-Elto-Signature', '')
-        if not signature:
-            print("❌ Missing X-Elto-Signature header")
-            return {"error": "Missing signature header"}, 401
+        if not verify_webhook_signature(raw_body, signature, _WEBHOOK_SECRET_BYTES):
+            logger.warning("❌ Invalid webhook signature")
+            return JSONResponse({"error": "Invalid signature"}, status_code=401)
         
-        if not verify_webhook_signature(raw_body, signature, VOGENT_WEBHOOK_SECRET):
-            print("❌ Invalid webhook signature")
-            return {"error": "Invalid signature"}, 401
-        
-        print("✅ Webhook signature verified successfully")
+        logger.debug("✅ Webhook signature verified successfully")
         
         # Parse JSON data after signature verification
-        data = json.loads(raw_body.decode('utf-8'))
+        data = orjson.loads(raw_body)
         event_type = data.get('event')
         payload = data.get('payload', {})
         
-        print(f"Event type: {event_type}")
+        logger.info("Event type: %s", event_type)
         
         # Extract metadata from top level of webhook data (not from payload)
         webhook_metadata = data.get('metadata', {})
@@ -139,7 +237,7 @@ async def vogent_webhook(request: Request):
         extracted_batch_id = webhook_metadata.get('batchId')
         
         if extracted_lead_id or extracted_batch_id:
-            print(f"🎯 Found metadata in webhook - leadId: {extracted_lead_id}, batchId: {extracted_batch_id}")
+            logger.debug("🎯 Found metadata in webhook - leadId: %s, batchId: %s", extracted_lead_id, extracted_batch_id)
         
         # Only process the extractor event - that's when we send to N8N
         if event_type == "dial.extractor":
@@ -147,37 +245,34 @@ async def vogent_webhook(request: Request):
             dial_id = payload.get('dial_id')
             ai_result = payload.get('ai_result', {})
             
-            print(f"🤖 Received AI extraction for call {dial_id}")
-            print(f"   Lead ID: {extracted_lead_id}")
-            print(f"   Batch ID: {extracted_batch_id}")
+            logger.info("🤖 Received AI extraction for call %s", dial_id)
+            logger.debug("   Lead ID: %s", extracted_lead_id)
+            logger.debug("   Batch ID: %s", extracted_batch_id)
             
             # Send simplified data to N8N
             webhook_payload = {
-                "data": json.dumps(ai_result),
+                "data": orjson.dumps(ai_result).decode(),
                 "leadId": extracted_lead_id,
                 "batchId": extracted_batch_id,
                 "dialId": dial_id
             }
             
-            print(f"   Sending simplified payload to N8N")
-            response = await send_to_webhook(webhook_payload)
-            print(f"   N8N response: {response}")
+            # Forward to N8N after responding so Vogent gets its ACK without waiting on N8N
+            logger.info("   Queueing simplified payload for N8N")
+            background_tasks.add_task(send_to_webhook, webhook_payload)
             
         else:
             # Log other events but don't process them
             dial_id = payload.get('dial_id')
-            print(f"📌 Event {event_type} for call {dial_id} - logging only")
+            logger.info("📌 Event %s for call %s - logging only", event_type, dial_id)
         
-        print("===== END WEBHOOK PROCESSING =====\n")
-        # Return success to Vogent
-        return {"success": True}
+        logger.info("===== END WEBHOOK PROCESSING =====")
+        # Return success to Vogent. Built per request (from pre-encoded bytes) because
+        # FastAPI attaches this request's background tasks to the returned Response
+        return Response(content=_SUCCESS_BODY, media_type="application/json")
             
     except Exception as error:
-        print('\n❌ ERROR HANDLING VOGENT WEBHOOK:')
-        print(f"   Error: {str(error)}")
-        import traceback
-        traceback.print_exc()
-        print("===== END ERROR =====\n")
+        logger.exception("❌ ERROR HANDLING VOGENT WEBHOOK: %s", error)
         return {"error": str(error)}
 
 async def create_vogent_call(phone_number, lead_id=None, batch_id=None, resume_url=None):
@@ -186,64 +281,45 @@ async def create_vogent_call(phone_number, lead_id=None, batch_id=None, resume_u
     """
     url = "https://api.vogent.ai/api/dials"
     
-    headers = {
-        "Authorization": f"Bearer {VOGENT_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    # Metadata carries whichever of leadId/batchId were provided
+    metadata = {k: v for k, v in (("leadId", lead_id), ("batchId", batch_id)) if v}
     
+    # callAgentInput adds resumeUrl, but is only sent when leadId or batchId is provided
+    call_agent_input = {
+        k: v for k, v in (("leadId", lead_id), ("batchId", batch_id), ("resumeUrl", resume_url)) if v
+    } if metadata else {}
+    
+    # Build the payload in its final shape in one go
     payload = {
         "callAgentId": VOGENT_AGENT_ID,
         "aiVoiceId": VOGENT_VOICE_ID,
         "toNumber": phone_number,
         "fromNumberId": VOGENT_PHONE_NUMBER_ID,
         "browserCall": False,
-        "timeoutMinutes": 10
+        "timeoutMinutes": 10,
+        **({"callAgentInput": call_agent_input} if call_agent_input else {}),
+        **({"metadata": metadata} if metadata else {})
     }
     
-    # Add callAgentInput with leadId and batchId if provided
-    if lead_id or batch_id:
-        payload["callAgentInput"] = {}
-        if lead_id:
-            payload["callAgentInput"]["leadId"] = lead_id
-        if batch_id:
-            payload["callAgentInput"]["batchId"] = batch_id
-        if resume_url:
-            payload["callAgentInput"]["resumeUrl"] = resume_url
-    
-    # Add metadata if leadId is provided
-    if lead_id:
-        payload["metadata"] = {
-            "leadId": lead_id
-        }
-        # Add batchId to metadata if provided
-        if batch_id:
-            payload["metadata"]["batchId"] = batch_id
-    elif batch_id:
-        # If only batchId is provided without leadId
-        payload["metadata"] = {
-            "batchId": batch_id
-        }
-    
     try:
-        # Use async httpx client with proper timeout
-        timeout = httpx.Timeout(60.0, connect=15.0)  # 60s total, 15s connect for API calls
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(url, headers=headers, json=payload)
+        # Use the shared async httpx client with proper timeout
+        client = app.state.http
+        response = await client.post(url, headers=_VOGENT_HEADERS, json=payload, timeout=VOGENT_TIMEOUT)
         
         if not response.is_success:
-            print(f"Error creating Vogent call: {response.status_code} {response.text}")
+            logger.error("Error creating Vogent call: %s %s", response.status_code, response.text)
             return None
         
         return response.json()
         
     except httpx.TimeoutException as e:
-        print(f"Timeout creating Vogent call: {str(e)}")
+        logger.error("Timeout creating Vogent call: %s", e)
         return None
     except httpx.RequestError as e:
-        print(f"Request error creating Vogent call: {str(e)}")
+        logger.error("Request error creating Vogent call: %s", e)
         return None
     except Exception as e:
-        print(f"Unexpected error creating Vogent call: {str(e)}")
+        logger.error("Unexpected error creating Vogent call: %s", e)
         return None
 
 async def send_to_webhook(payload):
@@ -251,74 +327,85 @@ async def send_to_webhook(payload):
     Send data to N8N webhook using async HTTP client
     """
     if not N8N_WEBHOOK_URL:
-        print("Error: N8N_WEBHOOK_URL is not set")
+        logger.error("Error: N8N_WEBHOOK_URL is not set")
         return json.dumps({"error": "N8N_WEBHOOK_URL not configured"})
         
     try:
-        print(f"Sending to N8N webhook: {N8N_WEBHOOK_URL}")
-        print(f"Payload: {json.dumps(payload)}")
+        logger.info("Sending to N8N webhook: %s", N8N_WEBHOOK_URL)
         
-        # Use async httpx client with proper timeout and error handling
-        timeout = httpx.Timeout(30.0, connect=10.0)  # 30s total, 10s connect
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(
-                N8N_WEBHOOK_URL,
-                json=payload,
-                headers={"Content-Type": "application/json"}
-            )
+        # Serialize once: the same bytes are sent and, at DEBUG level only, logged
+        body = orjson.dumps(payload)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Payload: %s", body.decode('utf-8'))
+        
+        # Use the shared async httpx client with proper timeout and error handling
+        client = app.state.http
+        response = await client.post(
+            N8N_WEBHOOK_URL,
+            content=body,
+            headers=_N8N_HEADERS,
+            timeout=N8N_TIMEOUT
+        )
         
         if response.status_code != 200:
-            print(f"⚠️ N8N webhook returned status code {response.status_code}")
-            print(f"Response: {response.text}")
+            logger.warning("⚠️ N8N webhook returned status code %s", response.status_code)
+            logger.warning("Response: %s", response.text)
             return json.dumps({"error": f"N8N webhook returned status {response.status_code}"})
         
-        # Truncate long responses in logs
+        # Truncate long responses in logs (httpx decodes and caches .text once, using the response charset)
         response_text = response.text
         if len(response_text) > 500:
-            print(f"N8N response (truncated): {response_text[:500]}... [truncated]")
+            logger.info("N8N response (truncated): %s... [truncated]", response_text[:500])
         else:
-            print(f"N8N response: {response_text}")
+            logger.info("N8N response: %s", response_text)
             
-        return response.text
+        return response_text
         
     except httpx.TimeoutException as e:
         error_msg = f"Timeout sending data to N8N webhook: {str(e)}"
-        print(f"❌ {error_msg}")
+        logger.error("❌ %s", error_msg)
         return json.dumps({"error": error_msg})
     except httpx.RequestError as e:
         error_msg = f"Request error sending data to N8N webhook: {str(e)}"
-        print(f"❌ {error_msg}")
+        logger.error("❌ %s", error_msg)
         return json.dumps({"error": error_msg})
     except Exception as e:
         error_msg = f"Unexpected error sending data to N8N webhook: {str(e)}"
-        print(f"❌ {error_msg}")
+        logger.error("❌ %s", error_msg)
         return json.dumps({"error": error_msg})
 
 def standardize_phone_number(phone_number):
     """
     Standardize phone number to E.164 format (+[country code][number])
     """
-    # Remove all non-digit characters
-    digits_only = re.sub(r'\D', '', phone_number)
-    
-    # If the number starts with country code
+    # isdecimal() accepts exactly the characters \D leaves in place, so these
+    # fast paths give the same result as the regex without allocating a copy
     if phone_number.startswith('+'):
-        return f"+{digits_only}"
+        # Already E.164 (+ followed only by digits) - return unchanged
+        if phone_number[1:].isdecimal():
+            return phone_number
+        return f"+{_NON_DIGIT_RE.sub('', phone_number)}"
+    
+    # Bare digit strings need no stripping; anything else falls back to the regex
+    digits_only = phone_number if phone_number.isdecimal() else _NON_DIGIT_RE.sub('', phone_number)
+    digit_count = len(digits_only)
     
     # If US/Canada number (10 digits)
-    if len(digits_only) == 10:
+    if digit_count == 10:
         return f"+1{digits_only}"
     
     # If US/Canada number with country code (11 digits starting with 1)
-    if len(digits_only) == 11 and digits_only.startswith('1'):
+    if digit_count == 11 and digits_only[0] == '1':
         return f"+{digits_only}"
     
     # Otherwise, return as is with + prefix
-    if len(digits_only) > 7:  # Basic validation to ensure it's a plausible number
+    if digit_count > 7:  # Basic validation to ensure it's a plausible number
         return f"+{digits_only}"
     
     return None  # Invalid number
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=PORT)
\ No newline at end of file
+    # loop/http default to "auto", which picks uvloop and httptools when installed
+    # (uvloop is not installed on Windows); request logging is handled by our own logger
+    uvicorn.run(app, host="0.0.0.0", port=PORT, access_log=False)
\ No newline at end of file